@@ -0,0 +1,51 @@
+"""Ketu package: the public API is re-exported lazily (PEP 562), so that
+importing ketu does not pull numpy and swisseph until a name is used"""
+
+import importlib
+
+__all__ = [
+    "get_bodies",
+    "get_aspects",
+    "get_body_names",
+    "get_aspect_names",
+    "bodies",
+    "aspects",
+    "signs",
+    "dd_to_dms",
+    "distance",
+    "get_orb",
+    "local_to_utc",
+    "utc_to_julian",
+    "julian_to_utc",
+    "body_name",
+    "body_properties",
+    "all_body_properties",
+    "body_id",
+    "long",
+    "lat",
+    "dist_au",
+    "vlong",
+    "vlat",
+    "vdist_au",
+    "is_retrograde",
+    "is_ascending",
+    "body_sign",
+    "positions",
+    "get_aspect",
+    "calculate_aspects",
+    "print_positions",
+    "print_aspects",
+    "main",
+]
+
+
+def __getattr__(name):
+    if name in __all__:
+        value = getattr(importlib.import_module(".ketu", __name__), name)
+        globals()[name] = value
+        return value
+    raise AttributeError(f"module {__name__!r} has no attribute {name!r}")
+
+
+def __dir__():
+    return sorted(__all__)
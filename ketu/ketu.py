@@ -1,54 +1,76 @@
 """Ketu is a python library to generate time series and calendars based on
 planetary aspects"""
 
-from datetime import datetime
-from functools import lru_cache
-from itertools import combinations as combs
+from datetime import datetime, timedelta
+from functools import cache, lru_cache
 from zoneinfo import ZoneInfo
 
 import numpy as np
 import swisseph as swe
 
 
-# Structured array of astronomical bodies: Sun, Moon, Mercury, Venus, Mars,
-# Jupiter, Saturn, Uranus, Neptune, Pluto, mean Node aka Rahu, true Node aka
-# North Node and mean Apogee aka Lilith, their Swiss Ephemeris id's, their
-# orb of influence (Inspired by Abu Ma’shar (787-886) and Al-Biruni (973-1050))
-# and their average speed in degrees per day
-bodies = np.array(
-    [
-        ("Sun", 0, 12, 0.986),
-        ("Moon", 1, 12, 13.176),
-        ("Mercury", 2, 8, 1.383),
-        ("Venus", 3, 8, 1.2),
-        ("Mars", 4, 10, 0.524),
-        ("Jupiter", 5, 10, 0.083),
-        ("Saturn", 6, 10, 0.034),
-        ("Uranus", 7, 6, 0.012),
-        ("Neptune", 8, 6, 0.007),
-        ("Pluto", 9, 4, 0.004),
-        ("Rahu", 10, 0, -0.013),
-        ("North Node", 11, 0, -0.013),
-        ("Lilith", 12, 0, 0.113),
-    ],
-    dtype=[("name", "S12"), ("id", "i4"), ("orb", "f4"), ("speed", "f4")],
-)
-
-# Structured array of major aspects (harmonics 2 and 3): Conjunction,
-# Semi-sextile, Sextile, Square, Trine, Quincunx and Opposition,
-# their value and their coefficient for the calculation of the orb
-aspects = np.array(
-    [
-        ("Conjunction", 0, 1),
-        ("Semi-sextile", 30, 1 / 6),
-        ("Sextile", 60, 1 / 3),
-        ("Square", 90, 1 / 2),
-        ("Trine", 120, 2 / 3),
-        ("Quincunx", 150, 5 / 6),
-        ("Opposition", 180, 1),
-    ],
-    dtype=[("name", "S12"), ("value", "f4"), ("coef", "f4")],
-)
+@cache
+def get_bodies():
+    """
+    Return the structured array of astronomical bodies: Sun, Moon, Mercury,
+    Venus, Mars, Jupiter, Saturn, Uranus, Neptune, Pluto, mean Node aka Rahu,
+    true Node aka North Node and mean Apogee aka Lilith, their Swiss Ephemeris
+    id's, their orb of influence (Inspired by Abu Ma’shar (787-886) and
+    Al-Biruni (973-1050)) and their average speed in degrees per day
+    """
+    return np.array(
+        [
+            ("Sun", 0, 12, 0.986),
+            ("Moon", 1, 12, 13.176),
+            ("Mercury", 2, 8, 1.383),
+            ("Venus", 3, 8, 1.2),
+            ("Mars", 4, 10, 0.524),
+            ("Jupiter", 5, 10, 0.083),
+            ("Saturn", 6, 10, 0.034),
+            ("Uranus", 7, 6, 0.012),
+            ("Neptune", 8, 6, 0.007),
+            ("Pluto", 9, 4, 0.004),
+            ("Rahu", 10, 0, -0.013),
+            ("North Node", 11, 0, -0.013),
+            ("Lilith", 12, 0, 0.113),
+        ],
+        dtype=[("name", "S12"), ("id", "i4"), ("orb", "f4"), ("speed", "f4")],
+    )
+
+
+@cache
+def get_aspects():
+    """
+    Return the structured array of major aspects (harmonics 2 and 3):
+    Conjunction, Semi-sextile, Sextile, Square, Trine, Quincunx and
+    Opposition, their value and their coefficient for the calculation
+    of the orb
+    """
+    return np.array(
+        [
+            ("Conjunction", 0, 1),
+            ("Semi-sextile", 30, 1 / 6),
+            ("Sextile", 60, 1 / 3),
+            ("Square", 90, 1 / 2),
+            ("Trine", 120, 2 / 3),
+            ("Quincunx", 150, 5 / 6),
+            ("Opposition", 180, 1),
+        ],
+        dtype=[("name", "S12"), ("value", "f4"), ("coef", "f4")],
+    )
+
+
+# The structured arrays are still exposed as module attributes, but their
+# construction is deferred to first access (PEP 562)
+_LAZY_ARRAYS = {"bodies": get_bodies, "aspects": get_aspects}
+
+
+def __getattr__(name):
+    if name in _LAZY_ARRAYS:
+        value = globals()[name] = _LAZY_ARRAYS[name]()
+        return value
+    raise AttributeError(f"module {__name__!r} has no attribute {name!r}")
+
 
 # List of signs for body position
 signs = [
@@ -69,73 +91,168 @@ signs = [
 
 def dd_to_dms(deg):
     """Return degrees, minutes, seconds from degrees decimal"""
-    mins, secs = divmod(deg * 3600, 60)
+    total = round(deg * 3600)
+    mins, secs = divmod(total, 60)
     degs, mins = divmod(mins, 60)
     return np.array((degs, mins, secs), dtype="i4")
 
 
 def distance(pos1, pos2):
-    """Return the angular distance from two bodies positions"""
-    angle = abs(pos2 - pos1)
-    return angle if angle <= 180 else 360 - angle
+    """Return the angular distance from two bodies positions, branchless
+    so it works elementwise on arrays as well as on scalars"""
+    angle = np.abs(pos2 - pos1) % 360
+    return 180 - np.abs(angle - 180)
+
+
+def _pair_distances(longs):
+    """
+    Return the indices of every pair of bodies and their angular
+    distances, computed with a single broadcast instead of a Python
+    loop over the combinations
+    """
+    index1, index2 = np.triu_indices(len(longs), k=1)
+    return index1, index2, distance(longs[index1], longs[index2])
+
+
+@cache
+def _body_ids():
+    """Contiguous view of the bodies id column for hot loops"""
+    return np.ascontiguousarray(get_bodies()["id"])
+
+
+@cache
+def _aspect_values():
+    """Contiguous float view of the aspects value column for hot loops"""
+    return np.ascontiguousarray(get_aspects()["value"], dtype="f8")
+
+
+@cache
+def _body_orbs():
+    """Contiguous float view of the bodies orb column for hot loops"""
+    return np.ascontiguousarray(get_bodies()["orb"], dtype="f8")
+
+
+@cache
+def _aspect_coefs():
+    """Contiguous float view of the aspects coef column for hot loops"""
+    return np.ascontiguousarray(get_aspects()["coef"], dtype="f8")
+
+
+@cache
+def _orb_table():
+    """Orb of every (body1, body2, aspect) triple, precomputed once"""
+    orbs = _body_orbs()
+    return (orbs[:, None] + orbs[None, :])[:, :, None] / 2 * _aspect_coefs()
 
 
 def get_orb(body1, body2, asp):
-    """Calculate the orb for two bodies and aspect"""
-    orbs, coef = bodies["orb"], aspects["coef"]
-    return (orbs[body1] + orbs[body2]) / 2 * coef[asp]
+    """Return the orb for two bodies and aspect"""
+    return _orb_table()[body1, body2, asp]
 
 
 # --------- interface functions with pyswisseph ---------
 
 
-def local_to_utc(dtime, zoneinfo=None):
-    """Convert local time to  UTC time"""
+def local_to_utc(dtime, zoneinfo=ZoneInfo("UTC")):
+    """Convert local time to UTC time"""
     if dtime.tzinfo is not None:
         return dtime - dtime.utcoffset()
-    year, month, day = dtime.year, dtime.month, dtime.day
-    hour, minute = dtime.hour, dtime.minute
-    return datetime(year, month, day, hour, minute, tzinfo=zoneinfo)
+    return dtime.replace(tzinfo=zoneinfo)
 
 
-def utc_to_julian(dtime):
-    """Convert UTC time to Julian date"""
-    if dtime.tzinfo is not None:
-        utc = local_to_utc(dtime)
-    else:
-        utc = dtime
+@lru_cache(maxsize=512)
+def _datetime_to_julian(utc):
+    """The key must be a naive datetime, an aware one hashes by instant
+    while the wall-clock fields are what is converted"""
     year, month, day = utc.year, utc.month, utc.day
     hour, minute, second = utc.hour, utc.minute, utc.second
     return swe.utc_to_jd(year, month, day, hour, minute, second, 1)[1]
 
 
+def utc_to_julian(dtime):
+    """
+    Convert UTC time to Julian date
+    Accept a single datetime or a numpy array of datetime64, in which
+    case the whole conversion runs as one vectorized subtraction
+    """
+    if isinstance(dtime, np.ndarray):
+        delta = dtime.astype("datetime64[us]") - np.datetime64("0001-01-01", "us")
+        return 1721425.5 + delta / np.timedelta64(1, "D")
+    return _datetime_to_julian(local_to_utc(dtime).replace(tzinfo=None))
+
+
+def julian_to_utc(jdate):
+    """
+    Convert Julian date to UTC time
+    Accept a single Julian date or a numpy array, in which case the
+    conversion is one vectorized addition returning datetime64
+    """
+    if isinstance(jdate, np.ndarray):
+        delta = ((jdate - 1721425.5) * 86_400_000_000).astype("timedelta64[us]")
+        return np.datetime64("0001-01-01", "us") + delta
+    year, month, day, hour, minute, second = swe.jdut1_to_utc(jdate, 1)
+    utc = datetime(year, month, day, hour, minute, tzinfo=ZoneInfo("UTC"))
+    return utc + timedelta(seconds=second)
+
+
+@cache
+def get_body_names():
+    """Return the body names as a list of str, decoded once"""
+    return get_bodies()["name"].astype(str).tolist()
+
+
+@cache
+def get_aspect_names():
+    """Return the aspect names as a list of str, decoded once"""
+    return get_aspects()["name"].astype(str).tolist()
+
+
 def body_name(body):
     """Return the body name"""
-    match swe.get_planet_name(body):
-        case "mean Node":
-            return "Rahu"
-        case "true Node":
-            return "North Node"
-        case "mean Apogee":
-            return "Lilith"
-    return swe.get_planet_name(body)
+    return get_body_names()[body]
+
+
+@lru_cache(maxsize=512)
+def _calc_properties(jdate, body):
+    return np.array(swe.calc_ut(jdate, body)[0])
 
 
-@lru_cache()
 def body_properties(jdate, body):
     """
     Return the body properties (longitude, latitude, distance to Earth in AU,
     longitude speed, latitude speed, distance speed) as a Numpy array
+    The date is quantized to one minute, so close queries share a cache
+    entry (the Moon moves less than 0.01 degree in a minute)
     """
-    return np.array(swe.calc_ut(jdate, body)[0])
+    return _calc_properties(round(jdate * 1440) / 1440, body)
+
+
+@lru_cache(maxsize=512)
+def _all_properties(jdate):
+    return np.array([_calc_properties(jdate, body) for body in _body_ids()])
+
+
+def all_body_properties(jdate):
+    """
+    Return the properties of all the bodies for a date as a single
+    (bodies, 6) array, swept once and cached with the same one-minute
+    quantization as body_properties
+    """
+    return _all_properties(round(jdate * 1440) / 1440)
 
 
 # --------------------------------------------------------
 
 
+@cache
+def _name_to_id():
+    """Map each body name to its id, built once for O(1) lookups"""
+    return dict(zip(get_body_names(), _body_ids()))
+
+
 def body_id(b_name):
     """Return the body id"""
-    return bodies["id"][np.where(bodies["name"] == b_name.encode())]
+    return _name_to_id()[b_name]
 
 
 def long(jdate, body):
@@ -179,17 +296,25 @@ def is_ascending(jdate, body):
 
 
 def body_sign(b_long):
-    """Return the body position in sign, degrees, minutes and seconds"""
-    dms = dd_to_dms(b_long)
-    sign, degs = divmod(dms[0], 30)
-    mins, secs = dms[1], dms[2]
+    """
+    Return the body position in sign, degrees, minutes and seconds
+    Work elementwise on an array of longitudes as well as on a scalar
+    """
+    total = (np.asarray(b_long) * 3600).astype("i8")
+    secs, mins = total % 60, total // 60 % 60
+    sign, degs = divmod(total // 3600, 30)
     return np.array((sign, degs, mins, secs))
 
 
-def positions(jdate, l_bodies=bodies):
+def positions(jdate, l_bodies=None):
     """Return an array of bodies longitude"""
+    if l_bodies is None:
+        return all_body_properties(jdate)[:, 0]
     bodies_id = l_bodies["id"]
-    return np.array([long(jdate, body) for body in bodies_id])
+    longs = np.empty(len(bodies_id))
+    for i, body in enumerate(bodies_id):
+        longs[i] = body_properties(jdate, body)[0]
+    return longs
 
 
 def get_aspect(jdate, body1, body2):
@@ -200,8 +325,9 @@ def get_aspect(jdate, body1, body2):
     if body1 > body2:
         body1, body2 = body2, body1
     dist = distance(long(jdate, body1), long(jdate, body2))
-    for i_asp, aspect in enumerate(aspects["value"]):
-        orb = get_orb(body1, body2, i_asp)
+    orbs = _orb_table()[body1, body2]
+    for i_asp, aspect in enumerate(_aspect_values()):
+        orb = orbs[i_asp]
         if i_asp == 0 and dist <= orb:
             return body1, body2, i_asp, dist
         elif aspect - orb <= dist <= aspect + orb:
@@ -209,33 +335,72 @@ def get_aspect(jdate, body1, body2):
     return None
 
 
-def calculate_aspects(jdate, l_bodies=bodies):
+def calculate_aspects(jdate, l_bodies=None):
     """
     Return a structured array of aspects and orb
-    Return None if there's no aspect
+    Return an empty array if there's no aspect
     """
-    bodies_id = l_bodies["id"]
-    aspects_data = [get_aspect(jdate, *comb) for comb in combs(bodies_id, 2)]
-    aspects_data = [aspect for aspect in aspects_data if aspect is not None]
-    return np.array(
-        aspects_data,
+    bodies_id = _body_ids() if l_bodies is None else l_bodies["id"]
+    index1, index2, dist = _pair_distances(positions(jdate, l_bodies))
+    values = _aspect_values()
+    orbs = _orb_table()[bodies_id[index1], bodies_id[index2]]
+    hits = np.abs(values - dist[:, None]) <= orbs
+    i_pair, i_asp = np.nonzero(hits)
+    aspects_data = np.empty(
+        len(i_pair),
         dtype=[("body1", "i4"), ("body2", "i4"), ("i_asp", "i4"), ("orb", "f4")],
     )
+    aspects_data["body1"] = bodies_id[index1[i_pair]]
+    aspects_data["body2"] = bodies_id[index2[i_pair]]
+    aspects_data["i_asp"] = i_asp
+    aspects_data["orb"] = np.where(i_asp == 0, dist[i_pair], values[i_asp] - dist[i_pair])
+    return aspects_data
 
 
-# TODO: find exact aspect
 def find_aspect(jdate, body1, body2):
-    pass
+    """
+    Find the exact time of the aspect formed by two bodies around a date
+    with a Newton iteration on the orb, using the analytic longitude
+    speeds returned by the Swiss Ephemeris as derivative
+    Return the two bodies, the aspect index and the Julian date of exactness
+    Return None if there's no aspect at that date or if the iteration
+    does not converge to the minute (near a station for instance)
+    """
+    aspect = get_aspect(jdate, body1, body2)
+    if aspect is None:
+        return None
+    body1, body2, i_asp, _ = aspect
+    angle = _aspect_values()[i_asp]
+    jday, best_jday, best_orb = jdate, jdate, 360
+    for _ in range(40):
+        separation = (long(jday, body2) - long(jday, body1)) % 360
+        vrel = vlong(jday, body2) - vlong(jday, body1)
+        if separation > 180:
+            separation, vrel = 360 - separation, -vrel
+        orb = separation - angle
+        if abs(orb) < abs(best_orb):
+            best_jday, best_orb = jday, orb
+        if abs(orb) < 1 / 3600 or vrel == 0:
+            break
+        # Clamp the Newton step: near a station vrel vanishes and an
+        # unbounded step jumps years away from the queried date
+        step = min(max(-orb / vrel, -15), 15)
+        jday += step
+        if abs(step) < 1 / 2880:
+            break
+    if abs(best_orb) > 1 / 60:
+        return None
+    return body1, body2, i_asp, best_jday
 
 
 def print_positions(jdate):
     """Function to format and print positions of the bodies for a date"""
     print("\n")
     print("------------- Bodies Positions -------------")
-    for index, pos in np.ndenumerate(positions(jdate)):
+    for body, pos in enumerate(positions(jdate)):
         sign, degs, mins, secs = body_sign(pos)
-        retro = ", R" if is_retrograde(jdate, *index) else ""
-        print(f"{body_name(*index):10}: " f"{signs[sign]:15}{degs:>2}º{mins:>2}'{secs:>2}\"{retro}")
+        retro = ", R" if is_retrograde(jdate, body) else ""
+        print(f"{body_name(body):10}: " f"{signs[sign]:15}{degs:>2}º{mins:>2}'{secs:>2}\"{retro}")
 
 
 def print_aspects(jdate):
@@ -247,7 +412,7 @@ def print_aspects(jdate):
         degs, mins, secs = dd_to_dms(orb)
         print(
             f"{body_name(body1):7} - {body_name(body2):12}: "
-            f"{aspects['name'][i_asp].decode():12} "
+            f"{get_aspect_names()[i_asp]:12} "
             f"{degs:>2}º{mins:>2}'{secs:>2}\""
         )
 
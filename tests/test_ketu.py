@@ -2,18 +2,21 @@ from datetime import datetime
 from unittest import TestCase
 from zoneinfo import ZoneInfo
 
-from numpy import array, where, dtype
+from numpy import array
 
 from ketu.ketu import (
     bodies,
     aspects,
     signs,
-    degrees_to_dms,
+    dd_to_dms,
     local_to_utc,
     utc_to_julian,
     julian_to_utc,
-    is_retrograd,
+    is_retrograde,
     is_ascending,
+    distance,
+    long,
+    find_aspect,
 )
 
 zoneinfo = ZoneInfo("Europe/Paris")
@@ -26,12 +29,12 @@ utc = ZoneInfo("UTC")
 class KetuTest(TestCase):
 
     def test_bodies(self):
-        self.assertEqual(len(bodies), 12)
-        self.assertEqual(bodies["swe_id"][0], 0)
+        self.assertEqual(len(bodies), 13)
+        self.assertEqual(bodies["id"][0], 0)
 
     def test_aspects(self):
         self.assertEqual(len(aspects), 7)
-        self.assertEqual(aspects["angle"][0], 0)
+        self.assertEqual(aspects["value"][0], 0)
 
     def test_signs(self):
         self.assertEqual(len(signs), 12)
@@ -44,6 +47,32 @@ class KetuTest(TestCase):
     def test_utc_to_julian(self):
         self.assertEqual(utc_to_julian(day_one), 1721425.5)
 
-    def test_degrees_to_dms(self):
-        datatype = dtype([("degs", "i4"), ("mins", "i4"), ("secs", "i4")])
-        self.assertEqual(degrees_to_dms(271.45), array((271, 27, 0), dtype=datatype))
+    def test_julian_to_utc_second_carry(self):
+        # A second fraction rounding up to a full second used to raise
+        # ValueError on the microsecond field
+        converted = julian_to_utc(2459205.500599808991)
+        self.assertEqual(converted.year, 2020)
+
+    def test_utc_to_julian_mixed_aware_naive(self):
+        # An aware conversion must not pollute the cache entry of a naive
+        # datetime denoting a different UTC time
+        utc_to_julian(datetime(2020, 12, 21, 19, 20, tzinfo=zoneinfo))
+        self.assertAlmostEqual(utc_to_julian(datetime(2020, 12, 21, 17, 20)), 2459205.2222202, places=6)
+
+    def test_find_aspect_station(self):
+        # A Mercury-Venus conjunction queried near a Mercury station used
+        # to diverge years away with a huge residual orb; the safeguarded
+        # iteration reports the missing convergence instead
+        self.assertIsNone(find_aspect(2457038.283, 2, 3))
+
+    def test_find_aspect_convergence(self):
+        # The Sun-Moon square around the same epoch converges to exactness
+        result = find_aspect(2459205.26, 0, 1)
+        self.assertIsNotNone(result)
+        body1, body2, i_asp, exact_jday = result
+        orb = distance(long(exact_jday, body1), long(exact_jday, body2)) - aspects["value"][i_asp]
+        self.assertLess(abs(orb), 1 / 60)
+        self.assertLess(abs(exact_jday - 2459205.26), 40)
+
+    def test_dd_to_dms(self):
+        self.assertTrue((dd_to_dms(271.45) == array((271, 27, 0), dtype="i4")).all())